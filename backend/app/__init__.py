@@ -1,11 +1,12 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from .routers import note, provider, model, config, chat
 
 
 
 def create_app(lifespan) -> FastAPI:
-    app = FastAPI(title="BiliNote",lifespan=lifespan)
+    app = FastAPI(title="BiliNote", lifespan=lifespan, default_response_class=ORJSONResponse)
     app.include_router(note.router, prefix="/api")
     app.include_router(provider.router, prefix="/api")
     app.include_router(model.router,prefix="/api")
@@ -9,9 +9,13 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bili_note.db")
 
 # SQLite 需要特定连接参数，其他数据库不需要
-engine_args = {}
+engine_args = {"pool_pre_ping": True}
 if DATABASE_URL.startswith("sqlite"):
     engine_args["connect_args"] = {"check_same_thread": False}
+else:
+    # 连接池参数仅对服务端数据库生效
+    engine_args["pool_size"] = int(os.getenv("DB_POOL_SIZE", 20))
+    engine_args["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", 10))
 
 engine = create_engine(
     DATABASE_URL,
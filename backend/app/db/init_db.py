@@ -1,10 +1,47 @@
+from sqlalchemy import delete, func, select
+
 from app.db.models.models import Model
 from app.db.models.providers import Provider
 from app.db.models.video_tasks import VideoTask
 from app.db.models.chat_models import ChatSession, ChatMessage
+from app.db.models.task_transcripts import TaskTranscript
 from app.db.engine import get_engine, Base
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 
 def init_db():
     engine = get_engine()
 
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    migrate_chat_indexes(engine)
+
+
+# create_all 不会给已存在的表补建索引，旧库升级时在此补建（可重复执行）
+def migrate_chat_indexes(engine):
+    key_columns = (ChatSession.task_id, ChatSession.provider_id, ChatSession.model_name)
+    with engine.begin() as conn:
+        # 唯一索引建立前，先清理同一任务/提供商/模型下的重复会话，保留最早创建的一个
+        duplicate_keys = conn.execute(
+            select(*key_columns).group_by(*key_columns).having(func.count() > 1)
+        ).all()
+        removed = 0
+        for task_id, provider_id, model_name in duplicate_keys:
+            session_ids = conn.execute(
+                select(ChatSession.id).where(
+                    ChatSession.task_id == task_id,
+                    ChatSession.provider_id == provider_id,
+                    ChatSession.model_name == model_name,
+                ).order_by(ChatSession.created_at.asc(), ChatSession.id.asc())
+            ).scalars().all()
+            stale_ids = session_ids[1:]
+            conn.execute(delete(ChatMessage).where(ChatMessage.session_id.in_(stale_ids)))
+            conn.execute(delete(ChatSession).where(ChatSession.id.in_(stale_ids)))
+            removed += len(stale_ids)
+        if removed:
+            logger.info(f"Removed {removed} duplicate chat session(s) before creating unique index")
+
+    for table in (ChatSession.__table__, ChatMessage.__table__):
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.engine import Base
@@ -9,7 +9,7 @@ class ChatSession(Base):
     __tablename__ = "chat_sessions"
     
     id = Column(String(50), primary_key=True, index=True)
-    task_id = Column(String(50), nullable=False, index=True)
+    task_id = Column(String(50), nullable=False)
     provider_id = Column(String(50), nullable=False)
     model_name = Column(String(100), nullable=False)
     note_content = Column(Text, nullable=False)
@@ -19,16 +19,26 @@ class ChatSession(Base):
     # 关联消息
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 同一任务下每个提供商/模型组合只对应一个会话
+        Index("ix_chat_sessions_task_provider_model", "task_id", "provider_id", "model_name", unique=True),
+    )
+
 
 class ChatMessage(Base):
     """聊天消息表"""
     __tablename__ = "chat_messages"
     
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String(50), ForeignKey("chat_sessions.id"), nullable=False)
+    session_id = Column(String(50), ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(20), nullable=False)  # 'user' 或 'assistant'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # 关联会话
-    session = relationship("ChatSession", back_populates="messages") 
\ No newline at end of file
+    session = relationship("ChatSession", back_populates="messages")
+
+    __table_args__ = (
+        # 按会话拉取历史时按时间排序
+        Index("ix_chat_messages_session_created", "session_id", "created_at"),
+    ) 
\ No newline at end of file
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from sqlalchemy import Column, String, DateTime, LargeBinary, func
+
+from app.db.engine import Base
+
+
+class TaskTranscript(Base):
+    """任务转写分段表，segments_json 为 orjson 序列化后的分段列表"""
+    __tablename__ = "task_transcripts"
+
+    task_id = Column(String(50), primary_key=True)
+    segments_json = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    # 由应用侧写入（精确到微秒），作为转写版本号
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
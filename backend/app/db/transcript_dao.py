@@ -0,0 +1,68 @@
+from pathlib import Path
+from typing import List, Optional
+
+import orjson
+from sqlalchemy.orm import Session
+
+from app.db.engine import get_db
+from app.db.models.task_transcripts import TaskTranscript
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# 写入或覆盖任务转写分段
+def upsert_task_transcript(task_id: str, segments: List[dict]):
+    db = next(get_db())
+    try:
+        db.merge(TaskTranscript(task_id=task_id, segments_json=orjson.dumps(segments)))
+        db.commit()
+        logger.info(f"Task transcript saved. task_id: {task_id}, segments: {len(segments)}")
+    except Exception as e:
+        logger.error(f"Failed to save task transcript: {e}")
+    finally:
+        db.close()
+
+
+# 查询转写分段（原始 JSON 字节），使用调用方的数据库会话
+def get_task_transcript_json(db: Session, task_id: str) -> Optional[bytes]:
+    row = db.query(TaskTranscript.segments_json).filter_by(task_id=task_id).first()
+    return row.segments_json if row else None
+
+
+# 查询转写版本（最后写入时间），用于上层缓存失效
+def get_task_transcript_version(db: Session, task_id: str) -> Optional[float]:
+    row = db.query(TaskTranscript.updated_at).filter_by(task_id=task_id).first()
+    if row is None:
+        return None
+    return row.updated_at.timestamp() if row.updated_at else 0.0
+
+
+# 将旧版 note_results/*_transcript.json 导入数据库，已存在的任务跳过
+def import_transcript_files(directory: Path) -> int:
+    if not directory.exists():
+        return 0
+    db = next(get_db())
+    try:
+        existing = {task_id for (task_id,) in db.query(TaskTranscript.task_id)}
+        imported = 0
+        for path in directory.glob("*_transcript.json"):
+            task_id = path.name[:-len("_transcript.json")]
+            if task_id in existing:
+                continue
+            try:
+                data = orjson.loads(path.read_bytes())
+            except Exception as e:
+                logger.warning(f"Skip invalid transcript file {path}: {e}")
+                continue
+            db.add(TaskTranscript(task_id=task_id, segments_json=orjson.dumps(data.get("segments", []))))
+            imported += 1
+        db.commit()
+        if imported:
+            logger.info(f"Imported {imported} transcript file(s) into database")
+        return imported
+    except Exception as e:
+        logger.error(f"Failed to import transcript files: {e}")
+        return 0
+    finally:
+        db.close()
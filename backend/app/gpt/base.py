@@ -18,11 +18,11 @@ class GPT(ABC):
         pass
     
     # 新增聊天相关方法
-    def create_chat_session(self, session_id: str, note_content: str) -> str:
+    async def create_chat_session(self, session_id: str, note_content: str) -> str:
         """创建聊天会话"""
         pass
     
-    def send_chat_message(self, session_id: str, message: str, note_content: str) -> str:
+    async def send_chat_message(self, session_id: str, message: str, note_content: str) -> str:
         """发送聊天消息"""
         pass
     
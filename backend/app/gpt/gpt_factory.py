@@ -9,5 +9,6 @@ from app.models.model_config import ModelConfig
 class GPTFactory:
     @staticmethod
     def from_config(config: ModelConfig) -> GPT:
-        client = OpenAICompatibleProvider(api_key=config.api_key, base_url=config.base_url).get_client
-        return UniversalGPT(client=client, model=config.model_name)
\ No newline at end of file
+        provider = OpenAICompatibleProvider(api_key=config.api_key, base_url=config.base_url)
+        return UniversalGPT(client=provider.get_client, model=config.model_name,
+                            async_client=provider.get_async_client)
\ No newline at end of file
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Protocol, Tuple
+
+import numpy as np
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class CacheBackend(Protocol):
+    """LLM 响应缓存的存储后端"""
+
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def set(self, key: str, value: str) -> None:
+        ...
+
+
+class MemoryCacheBackend:
+    """进程内 LRU 缓存"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class RedisCacheBackend:
+    """Redis 缓存，多进程/多实例部署时共享"""
+
+    def __init__(self, url: str, ttl: int = 24 * 3600, prefix: str = "bilinote:llm:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: str) -> None:
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+
+class LLMCache:
+    """按请求内容精确匹配的 LLM 响应缓存，仅缓存确定性（temperature == 0）的调用"""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    @staticmethod
+    def cache_key(model: str, messages: List[Dict], temperature: float,
+                  tools: Optional[List[Dict]] = None) -> Optional[str]:
+        # 有随机性的调用不缓存
+        if temperature > 0:
+            return None
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "tools": tools,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"读取 LLM 缓存失败：{e}")
+            return None
+
+    def set(self, key: Optional[str], value: str) -> None:
+        if key is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            logger.warning(f"写入 LLM 缓存失败：{e}")
+
+
+class SemanticCache:
+    """
+    语义缓存：对用户问题做向量化，在同一分桶（同一模型 + 同一对话前缀，即笔记/原文与此前的对话）内
+    查找余弦相似度最高的历史问题，超过阈值则直接复用其回答。
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries_per_bucket: int = 256):
+        self.threshold = threshold
+        self.max_entries_per_bucket = max_entries_per_bucket
+        # bucket -> (归一化向量矩阵, 对应回答)
+        self._buckets: Dict[str, Tuple[np.ndarray, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def bucket_key(model: str, prefix_messages: List[Dict]) -> str:
+        raw = json.dumps({"model": model, "prefix": prefix_messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, bucket: str, embedding: List[float]) -> Optional[str]:
+        query = self._normalize(embedding)
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is None:
+                return None
+            vectors, responses = entry
+            if vectors.shape[1] != query.shape[0]:
+                return None
+            scores = vectors @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return responses[best]
+            return None
+
+    def set(self, bucket: str, embedding: List[float], response: str) -> None:
+        vector = self._normalize(embedding)[np.newaxis, :]
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is None or entry[0].shape[1] != vector.shape[1]:
+                self._buckets[bucket] = (vector, [response])
+                return
+            vectors, responses = entry
+            vectors = np.vstack([vectors, vector])
+            responses = responses + [response]
+            # 超出容量时丢弃最早写入的条目
+            if len(responses) > self.max_entries_per_bucket:
+                vectors = vectors[-self.max_entries_per_bucket:]
+                responses = responses[-self.max_entries_per_bucket:]
+            self._buckets[bucket] = (vectors, responses)
+
+
+def _create_default_cache() -> LLMCache:
+    redis_url = os.getenv("LLM_CACHE_REDIS_URL")
+    if redis_url:
+        try:
+            return LLMCache(RedisCacheBackend(redis_url))
+        except Exception as e:
+            logger.warning(f"Redis 缓存不可用，退回进程内缓存：{e}")
+    return LLMCache(MemoryCacheBackend(int(os.getenv("LLM_CACHE_MAX_SIZE", 1024))))
+
+
+llm_cache = _create_default_cache()
+
+# 未配置向量模型时不启用语义缓存
+SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL")
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+) if SEMANTIC_CACHE_EMBEDDING_MODEL else None
@@ -1,23 +1,54 @@
+import threading
 from typing import Optional, Union
 
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 
 from app.utils.logger import get_logger
 
 logging= get_logger(__name__)
+
+# 所有提供商共享的 HTTP 连接池，复用 keep-alive 连接，避免重复 TCP/TLS 握手
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_http_client_lock = threading.Lock()
+
+
+def get_shared_http_client() -> httpx.Client:
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = DefaultHttpxClient(limits=_HTTP_LIMITS)
+        return _http_client
+
+
+def get_shared_async_http_client() -> httpx.AsyncClient:
+    global _async_http_client
+    with _http_client_lock:
+        if _async_http_client is None:
+            _async_http_client = DefaultAsyncHttpxClient(limits=_HTTP_LIMITS)
+        return _async_http_client
+
 class OpenAICompatibleProvider:
     def __init__(self, api_key: str, base_url: str, model: Union[str, None]=None):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=get_shared_http_client())
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                        http_client=get_shared_async_http_client())
         self.model = model
 
     @property
     def get_client(self):
         return self.client
 
+    @property
+    def get_async_client(self):
+        return self.async_client
+
     @staticmethod
     def test_connection(api_key: str, base_url: str) -> bool:
         try:
-            client = OpenAI(api_key=api_key, base_url=base_url)
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=get_shared_http_client())
             model = client.models.list()
             # for segment in model:
             #     print(segment)
@@ -1,35 +1,83 @@
 from app.gpt.base import GPT
 from app.gpt.prompt_builder import generate_base_prompt
 from app.models.gpt_model import GPTSource
-from app.gpt.prompt import BASE_PROMPT, AI_SUM, SCREENSHOT, LINK
+from app.gpt.prompt import BASE_PROMPT, AI_SUM, SCREENSHOT, LINK, CHAT_SYSTEM_PROMPT, CHAT_TRANSCRIPT_PROMPT
 from app.gpt.utils import fix_markdown
+from app.gpt.llm_cache import llm_cache, semantic_cache, SEMANTIC_CACHE_EMBEDDING_MODEL
 from app.models.transcriber_model import TranscriptSegment
-from datetime import timedelta
-from typing import List, Dict
+from app.utils.logger import get_logger
+from collections import OrderedDict
+from pydantic import TypeAdapter
+from typing import AsyncIterator, List, Dict, Optional
+import os
 import uuid
 
+logger = get_logger(__name__)
+
+# 聊天上下文中原文的最大字符数（中文约 1 token/字，即约 8k tokens）
+CHAT_TRANSCRIPT_MAX_CHARS = int(os.getenv("CHAT_TRANSCRIPT_MAX_CHARS", 8000))
+# 内存中保留的会话数，超出时淘汰最久未使用的会话
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", 256))
+# 每次请求携带的最大消息数（含 system 消息）
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", 20))
+
+# 批量校验转写分段，比逐个构造 TranscriptSegment 更快
+SEGMENTS_ADAPTER = TypeAdapter(List[TranscriptSegment])
+
+# 0~3599 秒对应的 mm:ss 文本，避免逐段格式化
+_MMSS = tuple(f"{m:02d}:{s:02d}" for m in range(60) for s in range(60))
+
+
+def format_time(seconds: float) -> str:
+    """将秒转换为 mm:ss 格式"""
+    secs = int(seconds)
+    if 0 <= secs < 3600:
+        return _MMSS[secs]
+    return f"{secs // 60:02d}:{secs % 60:02d}"
+
+
+def build_segment_text(segments: List[TranscriptSegment]) -> str:
+    """构建带时间区间的转写文本"""
+    if not segments:
+        return ""
+    return "\n".join(
+        f"[{format_time(segment.start)}-{format_time(segment.end)}] {segment.text}"
+        for segment in segments
+    )
+
 
 class UniversalGPT(GPT):
-    def __init__(self, client, model: str, temperature: float = 0.7):
+    def __init__(self, client, model: str, temperature: float = 0.7, async_client=None):
         self.client = client
+        # 聊天接口使用的异步客户端
+        self.async_client = async_client
         self.model = model
         self.temperature = temperature
         self.screenshot = False
         self.link = False
-        # 聊天会话存储（实际项目中应该使用数据库）
-        self.chat_sessions = {}
-
-    def _format_time(self, seconds: float) -> str:
-        return str(timedelta(seconds=int(seconds)))[2:]
-
-    def _build_segment_text(self, segments: List[TranscriptSegment]) -> str:
-        return "\n".join(
-            f"{self._format_time(seg.start)} - {seg.text.strip()}"
-            for seg in segments
-        )
+        # 聊天会话存储（LRU，被淘汰的会话可从数据库历史恢复）
+        self.chat_sessions: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._max_sessions = CHAT_MAX_SESSIONS
+        # 提供商侧的前缀（KV）缓存方式
+        self.prompt_cache_mode = self._detect_prompt_cache_mode(client)
+        # embeddings 接口调用失败后不再尝试语义缓存
+        self._embeddings_unavailable = False
+
+    @staticmethod
+    def _detect_prompt_cache_mode(client) -> Optional[str]:
+        """根据接口地址判断提供商支持的 prompt caching 方式"""
+        base_url = str(getattr(client, "base_url", "") or "")
+        if "api.openai.com" in base_url:
+            return "openai"
+        if "anthropic.com" in base_url:
+            return "anthropic"
+        return None
 
     def ensure_segments_type(self, segments) -> List[TranscriptSegment]:
-        return [TranscriptSegment(**seg) if isinstance(seg, dict) else seg for seg in segments]
+        # 调用方传入同构列表：全部为 dict 时整体校验，否则原样返回
+        if segments and isinstance(segments[0], dict):
+            return SEGMENTS_ADAPTER.validate_python(segments)
+        return segments
 
     def create_messages(self, segments: List[TranscriptSegment], **kwargs):
 
@@ -88,134 +136,245 @@ class UniversalGPT(GPT):
         return response.choices[0].message.content.strip()
 
     # 实现聊天功能
-    def create_chat_session(self, session_id: str, note_content: str, segments: List[TranscriptSegment] = None) -> str:
+    async def create_chat_session(self, session_id: str, note_content: str, transcript_text: str = None) -> str:
         """创建聊天会话，支持智能原文引用"""
-        
-        # 构建增强的system prompt
-        system_prompt = self._build_enhanced_system_prompt(note_content, segments)
-        
-        system_message = {
-            "role": "system",
-            "content": system_prompt
-        }
-        
-        # 初始化会话
-        self.chat_sessions[session_id] = [system_message]
-        
-        # 如果有原文数据，添加到会话中
-        if segments:
-            transcript_text = self._build_segment_text(segments)
-            self.chat_sessions[session_id].append({
-                "role": "system",
-                "content": f"完整转写原文：\n{transcript_text}"
-            })
-        
-        # 发送欢迎消息
+        messages = self._init_session(session_id, note_content, transcript_text)
+        return await self._send_welcome_message(session_id, messages)
+
+    async def _send_welcome_message(self, session_id: str, messages: List[Dict]) -> str:
+        """发送欢迎消息"""
         welcome_message = {
             "role": "user",
             "content": "你好，我想和你讨论这个笔记的内容。"
         }
-        
-        response = self._send_chat_message_internal(session_id, welcome_message)
-        return response
-
-    def _build_enhanced_system_prompt(self, note_content: str, segments: List[TranscriptSegment] = None) -> str:
-        """构建增强的system prompt"""
-        
-        base_prompt = f"""你是一个专业的视频笔记助手。用户正在查看以下笔记内容：
-
-{note_content}
-
-请基于这个笔记内容回答用户的问题，提供深入的分析和解释。
-回答要准确、有用，并保持对话的自然性。
-请用中文回答。"""
-
-        if segments:
-            base_prompt += f"""
 
-**智能原文引用功能**
+        # 欢迎语的输入固定，以 temperature=0 生成，使其可被精确缓存复用
+        return await self._send_chat_message_internal(session_id, messages, welcome_message, temperature=0)
 
-你还可以访问完整的视频转写原文，包含详细的时间戳和内容。请遵循以下原则：
-
-**主要原则：**
-1. **以笔记为主**：优先基于笔记内容回答问题，笔记是经过总结和提炼的核心信息
-2. **必要时引用原文**：当用户需要详细信息、具体内容、准确引用或时间定位时，才引用原文
-3. **智能判断**：根据用户问题的具体需求，决定是否需要补充原文信息
-
-**引用场景：**
-- 用户询问"具体说了什么"、"详细内容"、"原文"等
-- 用户需要时间定位或精确引用
-- 用户询问"为什么"、"如何"等需要深入分析的问题
-- 笔记内容不够详细，需要补充原文信息
-
-**引用格式：**
-引用原文时使用以下格式：
-📝 **原文引用 [时间戳]**: 具体内容
-
-**示例：**
-📝 **原文引用 [02:15]**: 这里提到了具体的概念...
-📝 **原文引用 [05:30]**: 关于这个问题的详细解释...
+    def _init_session(self, session_id: str, note_content: str, transcript_text: str = None) -> List[Dict]:
+        """初始化会话的 system 消息，返回会话的消息列表"""
+        # 构建增强的system prompt
+        system_prompt = self._build_enhanced_system_prompt(note_content, transcript_text)
+        
+        # 原文与笔记提示合并为单条 system 消息
+        transcript_text = self._truncate_transcript(transcript_text) if transcript_text else ""
+        if transcript_text:
+            system_prompt += f"\n\n完整转写原文：\n{transcript_text}"
+        
+        # 笔记与原文构成每轮都不变的前缀，标记为可缓存
+        if self.prompt_cache_mode == "anthropic":
+            content = [{
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }]
+        else:
+            content = system_prompt
+        
+        # 初始化会话
+        messages = [{"role": "system", "content": content}]
+        self._store_session(session_id, messages)
+        return messages
 
-请根据用户问题的具体需求，智能判断是否需要引用原文来提供更准确和详细的回答。"""
+    def _store_session(self, session_id: str, messages: List[Dict]):
+        """写入会话并淘汰最久未使用的会话"""
+        self.chat_sessions[session_id] = messages
+        self.chat_sessions.move_to_end(session_id)
+        while len(self.chat_sessions) > self._max_sessions:
+            self.chat_sessions.popitem(last=False)
+
+    def has_session(self, session_id: str) -> bool:
+        return session_id in self.chat_sessions
+
+    def discard_session(self, session_id: str):
+        """移除内存中的会话（如会话未能持久化）"""
+        self.chat_sessions.pop(session_id, None)
+
+    async def _ensure_session(self, session_id: str, note_content: str,
+                              transcript_text: str = None, history: List[Dict] = None) -> List[Dict]:
+        """
+        确保会话在内存中；已被淘汰的会话优先用数据库历史恢复。
+        返回会话的消息列表，调用方在 await 之后应使用该列表，不再按 session_id 查找（期间可能被 LRU 淘汰）
+        """
+        messages = self.chat_sessions.get(session_id)
+        if messages is not None:
+            self.chat_sessions.move_to_end(session_id)
+        elif history:
+            messages = self._init_session(session_id, note_content, transcript_text)
+            messages.extend(history)
+        else:
+            # 如果会话不存在，先创建
+            messages = self._init_session(session_id, note_content, transcript_text)
+            await self._send_welcome_message(session_id, messages)
+        return messages
 
+    def _trim_history(self, messages: List[Dict]):
+        """滑动窗口：保留 system 消息与最近的对话，且窗口以用户消息开头"""
+        if len(messages) <= CHAT_HISTORY_MAX_MESSAGES:
+            return
+        system_messages = [m for m in messages if m["role"] == "system"]
+        recent = [m for m in messages if m["role"] != "system"]
+        recent = recent[-max(CHAT_HISTORY_MAX_MESSAGES - len(system_messages), 1):]
+        while len(recent) > 1 and recent[0]["role"] != "user":
+            recent.pop(0)
+        messages[:] = system_messages + recent
+
+    def _build_enhanced_system_prompt(self, note_content: str, transcript_text: str = None) -> str:
+        """构建增强的system prompt"""
+        
+        base_prompt = CHAT_SYSTEM_PROMPT.format(note_content=note_content)
+        if transcript_text:
+            base_prompt += CHAT_TRANSCRIPT_PROMPT
         return base_prompt
 
     def _build_segment_text(self, segments: List[TranscriptSegment]) -> str:
         """构建转写文本"""
-        if not segments:
-            return ""
-        
-        text_parts = []
-        for segment in segments:
-            # 将秒转换为 mm:ss 格式
-            start_time = self._format_time(segment.start)
-            end_time = self._format_time(segment.end)
-            text_parts.append(f"[{start_time}-{end_time}] {segment.text}")
-        
-        return "\n".join(text_parts)
+        return build_segment_text(segments)
+
+    def _truncate_transcript(self, transcript_text: str) -> str:
+        """原文超出长度预算时截断"""
+        if len(transcript_text) > CHAT_TRANSCRIPT_MAX_CHARS:
+            transcript_text = transcript_text[:CHAT_TRANSCRIPT_MAX_CHARS] + "\n……（原文过长，已截断）"
+        return transcript_text
 
     def _format_time(self, seconds: float) -> str:
         """将秒转换为 mm:ss 格式"""
-        minutes = int(seconds // 60)
-        secs = int(seconds % 60)
-        return f"{minutes:02d}:{secs:02d}"
+        return format_time(seconds)
 
-    def send_chat_message(self, session_id: str, message: str, note_content: str, segments: List[TranscriptSegment] = None) -> str:
+    async def send_chat_message(self, session_id: str, message: str, note_content: str,
+                                transcript_text: str = None, history: List[Dict] = None) -> str:
         """发送聊天消息，支持智能原文引用"""
-        if session_id not in self.chat_sessions:
-            # 如果会话不存在，先创建
-            self.create_chat_session(session_id, note_content, segments)
+        messages = await self._ensure_session(session_id, note_content, transcript_text, history)
         
         user_message = {
             "role": "user",
             "content": message
         }
         
-        return self._send_chat_message_internal(session_id, user_message)
+        # 语义缓存：相同对话前缀下相近的问题直接复用回答
+        bucket, embedding, cached = await self._semantic_lookup(messages, message)
+        if cached is not None:
+            messages.append(user_message)
+            messages.append({"role": "assistant", "content": cached})
+            self._trim_history(messages)
+            return cached
+        
+        response = await self._send_chat_message_internal(session_id, messages, user_message)
+        if embedding:
+            semantic_cache.set(bucket, embedding, response)
+        return response
 
-    def _send_chat_message_internal(self, session_id: str, user_message: Dict) -> str:
-        """内部方法：发送聊天消息"""
+    async def _semantic_lookup(self, messages: List[Dict], message: str):
+        """查询语义缓存，分桶包含 system 消息与此前的全部对话，返回 (bucket, embedding, 命中的回答)"""
+        if semantic_cache is None or self._embeddings_unavailable:
+            return None, None, None
+        bucket = semantic_cache.bucket_key(self.model, messages)
+        embedding = await self._embed(message)
+        cached = semantic_cache.get(bucket, embedding) if embedding else None
+        return bucket, embedding, cached
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        """通过提供商的 embeddings 接口向量化文本，失败时返回 None"""
+        try:
+            result = await self.async_client.embeddings.create(model=SEMANTIC_CACHE_EMBEDDING_MODEL, input=text)
+            return result.data[0].embedding
+        except Exception as e:
+            # 提供商不支持 embeddings 时，避免每条消息都多一次失败的请求
+            self._embeddings_unavailable = True
+            logger.warning(f"文本向量化失败，该模型后续不再使用语义缓存：{e}")
+            return None
+
+    async def _send_chat_message_internal(self, session_id: str, messages: List[Dict], user_message: Dict,
+                                          temperature: float = None) -> str:
+        """内部方法：发送聊天消息，temperature 未指定时使用实例默认值"""
+        if temperature is None:
+            temperature = self.temperature
+        
         # 添加用户消息到历史
-        self.chat_sessions[session_id].append(user_message)
+        messages.append(user_message)
+        self._trim_history(messages)
         
-        # 调用API
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.chat_sessions[session_id],
-            temperature=self.temperature
-        )
+        # 确定性调用先查缓存，命中则跳过API请求
+        cache_key = llm_cache.cache_key(self.model, messages, temperature)
+        content = llm_cache.get(cache_key)
+        if content is None:
+            # 调用API
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                **self._prompt_cache_kwargs(session_id)
+            )
+            content = response.choices[0].message.content
+            llm_cache.set(cache_key, content)
         
         # 获取AI回复
         assistant_message = {
             "role": "assistant",
-            "content": response.choices[0].message.content
+            "content": content
         }
         
         # 添加AI回复到历史
-        self.chat_sessions[session_id].append(assistant_message)
+        messages.append(assistant_message)
         
         return assistant_message["content"]
 
+    async def stream_chat_message(self, session_id: str, message: str, note_content: str,
+                                  transcript_text: str = None,
+                                  history: List[Dict] = None) -> AsyncIterator[str]:
+        """流式发送聊天消息，逐段产出AI回复"""
+        messages = await self._ensure_session(session_id, note_content, transcript_text, history)
+
+        bucket, embedding, cached = await self._semantic_lookup(messages, message)
+
+        messages.append({"role": "user", "content": message})
+        if cached is not None:
+            messages.append({"role": "assistant", "content": cached})
+            self._trim_history(messages)
+            yield cached
+            return
+        self._trim_history(messages)
+        
+        cache_key = llm_cache.cache_key(self.model, messages, self.temperature)
+        content = llm_cache.get(cache_key)
+        if content is not None:
+            messages.append({"role": "assistant", "content": content})
+            yield content
+            return
+        
+        parts = []
+        try:
+            stream = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                stream=True,
+                **self._prompt_cache_kwargs(session_id)
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except BaseException:
+            # 未完成的一轮不保留在历史中
+            messages.pop()
+            raise
+        
+        content = "".join(parts)
+        llm_cache.set(cache_key, content)
+        if embedding:
+            semantic_cache.set(bucket, embedding, content)
+        messages.append({"role": "assistant", "content": content})
+
+    def _prompt_cache_kwargs(self, session_id: str) -> Dict:
+        """OpenAI 通过 prompt_cache_key 将同一会话路由到已缓存前缀的节点"""
+        if self.prompt_cache_mode == "openai":
+            return {"extra_body": {"prompt_cache_key": session_id}}
+        return {}
+
     def get_chat_history(self, session_id: str) -> List[Dict]:
         """获取聊天历史"""
         if session_id not in self.chat_sessions:
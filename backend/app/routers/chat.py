@@ -1,13 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+import orjson
+
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
 from typing import List, Dict, Optional
 
+from app.db.engine import get_db
 from app.services.chat import ChatService
+from app.utils.orjson_route import ORJSONRoute
 from app.utils.response import ResponseWrapper as R
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
+
+# 笔记内容长度上限，拒绝异常大的请求体
+NOTE_CONTENT_MAX_LENGTH = 500_000
 
 # 聊天服务实例
 chat_service = ChatService()
@@ -15,7 +24,7 @@ chat_service = ChatService()
 
 class CreateChatSessionRequest(BaseModel):
     task_id: str
-    note_content: str
+    note_content: str = Field(max_length=NOTE_CONTENT_MAX_LENGTH)
     provider_id: str
     model_name: str
 
@@ -23,7 +32,7 @@ class CreateChatSessionRequest(BaseModel):
 class SendMessageRequest(BaseModel):
     session_id: str
     message: str
-    note_content: str
+    note_content: str = Field(max_length=NOTE_CONTENT_MAX_LENGTH)
     provider_id: str
     model_name: str
     task_id: Optional[str] = None
@@ -36,10 +45,11 @@ class ChatMessage(BaseModel):
 
 
 @router.post("/chat/sessions")
-def create_chat_session(request: CreateChatSessionRequest):
+async def create_chat_session(request: CreateChatSessionRequest, db: Session = Depends(get_db)):
     """创建聊天会话"""
     try:
-        result = chat_service.create_chat_session(
+        result = await chat_service.create_chat_session(
+            db=db,
             task_id=request.task_id,
             note_content=request.note_content,
             provider_id=request.provider_id,
@@ -57,10 +67,11 @@ def create_chat_session(request: CreateChatSessionRequest):
 
 
 @router.post("/chat/messages")
-def send_message(request: SendMessageRequest):
+async def send_message(request: SendMessageRequest, db: Session = Depends(get_db)):
     """发送聊天消息"""
     try:
-        result = chat_service.send_message(
+        result = await chat_service.send_message(
+            db=db,
             session_id=request.session_id,
             message=request.message,
             note_content=request.note_content,
@@ -79,11 +90,35 @@ def send_message(request: SendMessageRequest):
         return R.error(msg=f"发送消息失败: {str(e)}")
 
 
+@router.post("/chat/messages/stream")
+async def stream_message(request: SendMessageRequest):
+    """流式发送聊天消息（Server-Sent Events）"""
+
+    async def event_stream():
+        try:
+            async for delta in chat_service.stream_message(
+                session_id=request.session_id,
+                message=request.message,
+                note_content=request.note_content,
+                provider_id=request.provider_id,
+                model_name=request.model_name,
+                task_id=request.task_id
+            ):
+                yield f"data: {orjson.dumps({'content': delta}).decode()}\n\n"
+            yield "data: [DONE]\n\n"
+        except Exception as e:
+            logger.error(f"Failed to stream message: {e}")
+            yield f"event: error\ndata: {orjson.dumps({'msg': f'发送消息失败: {str(e)}'}).decode()}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.get("/chat/sessions/{session_id}/history")
-def get_chat_history(session_id: str, provider_id: str, model_name: str):
+def get_chat_history(session_id: str, provider_id: str, model_name: str, db: Session = Depends(get_db)):
     """获取聊天历史"""
     try:
         history = chat_service.get_chat_history(
+            db=db,
             session_id=session_id,
             provider_id=provider_id,
             model_name=model_name
@@ -100,10 +135,11 @@ def get_chat_history(session_id: str, provider_id: str, model_name: str):
 
 
 @router.delete("/chat/sessions/{session_id}")
-def delete_chat_session(session_id: str, provider_id: str, model_name: str):
+def delete_chat_session(session_id: str, provider_id: str, model_name: str, db: Session = Depends(get_db)):
     """删除聊天会话"""
     try:
         success = chat_service.delete_chat_session(
+            db=db,
             session_id=session_id,
             provider_id=provider_id,
             model_name=model_name
@@ -1,14 +1,21 @@
+import threading
 import uuid
-import json
-from typing import Dict, List, Optional
-from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+import orjson
+from sqlalchemy import and_, delete, insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.gpt.base import GPT
 from app.gpt.gpt_factory import GPTFactory
+from app.gpt.llm_cache import MemoryCacheBackend
+from app.gpt.universal_gpt import CHAT_HISTORY_MAX_MESSAGES, SEGMENTS_ADAPTER, build_segment_text
 from app.models.model_config import ModelConfig
 from app.models.transcriber_model import TranscriptSegment
 from app.services.provider import ProviderService
 from app.utils.logger import get_logger
-from app.db.engine import get_db
+from app.db.engine import SessionLocal
+from app.db.transcript_dao import get_task_transcript_json, get_task_transcript_version
 from app.db.models.chat_models import ChatSession, ChatMessage
 
 logger = get_logger(__name__)
@@ -17,19 +24,21 @@ logger = get_logger(__name__)
 class ChatService:
     """聊天服务，管理聊天会话和消息"""
     
-    def __init__(self):
-        # 存储GPT实例的缓存
-        self.gpt_instances: Dict[str, any] = {}
-    
-    def _get_db_session(self) -> Session:
-        """获取数据库会话"""
-        return next(get_db())
+    # GPT实例缓存，所有 ChatService 实例共享
+    _GPT_CACHE: Dict[str, GPT] = {}
+    _GPT_CACHE_LOCK = threading.Lock()
+    # 格式化后的转写文本缓存，键为 task_id 与转写版本
+    _TRANSCRIPT_CACHE = MemoryCacheBackend(max_size=128)
     
     def _get_gpt_instance(self, provider_id: str, model_name: str):
         """获取或创建GPT实例"""
         cache_key = f"{provider_id}_{model_name}"
         
-        if cache_key not in self.gpt_instances:
+        with self._GPT_CACHE_LOCK:
+            gpt_instance = self._GPT_CACHE.get(cache_key)
+            if gpt_instance is not None:
+                return gpt_instance
+            
             # 获取提供商信息
             provider = ProviderService.get_provider_by_id(provider_id)
             if not provider:
@@ -46,67 +55,40 @@ class ChatService:
             
             # 创建GPT实例
             gpt_instance = GPTFactory().from_config(config)
-            self.gpt_instances[cache_key] = gpt_instance
-        
-        return self.gpt_instances[cache_key]
+            self._GPT_CACHE[cache_key] = gpt_instance
+            return gpt_instance
     
-    def get_or_create_session(self, task_id: str, note_content: str, 
+    async def get_or_create_session(self, db: Session, task_id: str, note_content: str, 
                             provider_id: str, model_name: str) -> Dict:
         """获取或创建聊天会话，支持转写数据"""
         try:
-            db = self._get_db_session()
+            # 数据库与转写读取放到线程池中执行，事件循环上只等待 LLM 调用
+            transcript_text = await run_in_threadpool(self._get_transcript_text, db, task_id)
             
-            # 获取转写数据
-            segments = self._get_task_transcript(task_id)
+            existing = await run_in_threadpool(self._find_existing_session, db, task_id, provider_id, model_name)
             
-            # 查找现有会话
-            existing_session = db.query(ChatSession).filter(
-                ChatSession.task_id == task_id,
-                ChatSession.provider_id == provider_id,
-                ChatSession.model_name == model_name
-            ).first()
-            
-            if existing_session:
+            if existing:
                 # 如果会话存在，返回现有会话
-                session_id = existing_session.id
-                # 获取欢迎消息（第一条助手消息）
-                welcome_message = db.query(ChatMessage).filter(
-                    ChatMessage.session_id == session_id,
-                    ChatMessage.role == 'assistant'
-                ).order_by(ChatMessage.created_at.asc()).first()
-                
-                return {
-                    "session_id": session_id,
-                    "welcome_message": welcome_message.content if welcome_message else "欢迎回来！",
-                    "status": "existing"
-                }
+                return self._existing_session_result(existing)
             else:
                 # 创建新会话
                 session_id = f"chat_{task_id}_{uuid.uuid4().hex[:8]}"
                 
-                # 创建数据库会话记录
-                new_session = ChatSession(
-                    id=session_id,
-                    task_id=task_id,
-                    provider_id=provider_id,
-                    model_name=model_name,
-                    note_content=note_content
-                )
-                db.add(new_session)
-                
                 # 获取GPT实例并创建会话
-                gpt_instance = self._get_gpt_instance(provider_id, model_name)
-                welcome_message = gpt_instance.create_chat_session(session_id, note_content, segments)
+                gpt_instance = await run_in_threadpool(self._get_gpt_instance, provider_id, model_name)
+                welcome_message = await gpt_instance.create_chat_session(session_id, note_content, transcript_text)
                 
-                # 保存欢迎消息到数据库
-                welcome_msg = ChatMessage(
-                    session_id=session_id,
-                    role='assistant',
-                    content=welcome_message
-                )
-                db.add(welcome_msg)
-                
-                db.commit()
+                try:
+                    await run_in_threadpool(self._insert_session, db, session_id, task_id, provider_id,
+                                            model_name, note_content, welcome_message)
+                except IntegrityError:
+                    # 并发打开同一会话时另一请求已先写入：丢弃本次创建的会话，返回已有会话
+                    await run_in_threadpool(db.rollback)
+                    gpt_instance.discard_session(session_id)
+                    existing = await run_in_threadpool(self._find_existing_session, db, task_id, provider_id, model_name)
+                    if not existing:
+                        raise
+                    return self._existing_session_result(existing)
                 
                 return {
                     "session_id": session_id,
@@ -117,48 +99,66 @@ class ChatService:
         except Exception as e:
             logger.error(f"Failed to get or create chat session: {e}")
             raise
-        finally:
-            db.close()
     
-    def create_chat_session(self, task_id: str, note_content: str, 
+    @staticmethod
+    def _insert_session(db: Session, session_id: str, task_id: str, provider_id: str, model_name: str,
+                        note_content: str, welcome_message: str):
+        """会话记录与欢迎消息在同一事务内以 Core insert 写入"""
+        db.execute(insert(ChatSession).values(
+            id=session_id,
+            task_id=task_id,
+            provider_id=provider_id,
+            model_name=model_name,
+            note_content=note_content
+        ))
+        db.execute(insert(ChatMessage).values(
+            session_id=session_id,
+            role='assistant',
+            content=welcome_message
+        ))
+        db.commit()
+    
+    @staticmethod
+    def _find_existing_session(db: Session, task_id: str, provider_id: str, model_name: str):
+        """查找现有会话，并在同一查询中带出欢迎消息（第一条助手消息）"""
+        return db.query(ChatSession.id, ChatMessage.content).outerjoin(
+            ChatMessage,
+            and_(
+                ChatMessage.session_id == ChatSession.id,
+                ChatMessage.role == 'assistant'
+            )
+        ).filter(
+            ChatSession.task_id == task_id,
+            ChatSession.provider_id == provider_id,
+            ChatSession.model_name == model_name
+        ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).first()
+    
+    @staticmethod
+    def _existing_session_result(existing) -> Dict:
+        session_id, welcome_message = existing
+        return {
+            "session_id": session_id,
+            "welcome_message": welcome_message or "欢迎回来！",
+            "status": "existing"
+        }
+    
+    async def create_chat_session(self, db: Session, task_id: str, note_content: str, 
                           provider_id: str, model_name: str) -> Dict:
         """创建聊天会话（保持向后兼容）"""
-        return self.get_or_create_session(task_id, note_content, provider_id, model_name)
+        return await self.get_or_create_session(db, task_id, note_content, provider_id, model_name)
     
-    def send_message(self, session_id: str, message: str, note_content: str,
+    async def send_message(self, db: Session, session_id: str, message: str, note_content: str,
                     provider_id: str, model_name: str, task_id: str = None) -> Dict:
         """发送聊天消息，支持转写数据"""
         try:
-            db = self._get_db_session()
-            
-            # 获取转写数据
-            segments = None
-            if task_id:
-                segments = self._get_task_transcript(task_id)
-            
-            # 保存用户消息到数据库
-            user_msg = ChatMessage(
-                session_id=session_id,
-                role='user',
-                content=message
+            transcript_text, gpt_instance, history = await run_in_threadpool(
+                self._prepare_message, db, session_id, provider_id, model_name, task_id
             )
-            db.add(user_msg)
-            
-            # 获取GPT实例
-            gpt_instance = self._get_gpt_instance(provider_id, model_name)
             
             # 发送消息
-            response = gpt_instance.send_chat_message(session_id, message, note_content, segments)
-            
-            # 保存AI回复到数据库
-            assistant_msg = ChatMessage(
-                session_id=session_id,
-                role='assistant',
-                content=response
-            )
-            db.add(assistant_msg)
+            response = await gpt_instance.send_chat_message(session_id, message, note_content, transcript_text, history)
             
-            db.commit()
+            await run_in_threadpool(self._insert_exchange, db, session_id, message, response)
             
             return {
                 "session_id": session_id,
@@ -169,19 +169,64 @@ class ChatService:
         except Exception as e:
             logger.error(f"Failed to send message: {e}")
             raise
-        finally:
-            db.close()
     
-    def get_chat_history(self, session_id: str, provider_id: str, 
+    async def stream_message(self, session_id: str, message: str, note_content: str,
+                             provider_id: str, model_name: str, task_id: str = None) -> AsyncIterator[str]:
+        """流式发送聊天消息，回复完整生成后再写入数据库"""
+        def prepare():
+            with SessionLocal() as db:
+                return self._prepare_message(db, session_id, provider_id, model_name, task_id)
+        
+        transcript_text, gpt_instance, history = await run_in_threadpool(prepare)
+        
+        parts = []
+        async for delta in gpt_instance.stream_chat_message(session_id, message, note_content, transcript_text, history):
+            parts.append(delta)
+            yield delta
+        
+        # 数据库写入放到线程池中执行，不阻塞事件循环
+        await run_in_threadpool(self._save_exchange, session_id, message, "".join(parts))
+    
+    def _prepare_message(self, db: Session, session_id: str, provider_id: str, model_name: str,
+                         task_id: str = None):
+        """读取转写文本、获取GPT实例，会话已被内存淘汰时用数据库中的最近历史恢复"""
+        transcript_text = self._get_transcript_text(db, task_id) if task_id else None
+        gpt_instance = self._get_gpt_instance(provider_id, model_name)
+        history = None
+        if not gpt_instance.has_session(session_id):
+            history = self._load_recent_history(db, session_id)
+        return transcript_text, gpt_instance, history
+    
+    @staticmethod
+    def _insert_exchange(db: Session, session_id: str, message: str, response: str):
+        """用户消息与AI回复合并为一次批量插入"""
+        db.execute(insert(ChatMessage), [
+            {"session_id": session_id, "role": "user", "content": message},
+            {"session_id": session_id, "role": "assistant", "content": response},
+        ])
+        db.commit()
+    
+    def _save_exchange(self, session_id: str, message: str, response: str):
+        """保存一轮用户消息与AI回复"""
+        with SessionLocal() as db:
+            self._insert_exchange(db, session_id, message, response)
+    
+    @staticmethod
+    def _load_recent_history(db: Session, session_id: str) -> List[Dict]:
+        """读取会话最近的消息，用于恢复内存中已淘汰的会话"""
+        rows = db.query(ChatMessage.role, ChatMessage.content).filter(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(CHAT_HISTORY_MAX_MESSAGES).all()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+    
+    def get_chat_history(self, db: Session, session_id: str, provider_id: str, 
                         model_name: str) -> List[Dict]:
         """获取聊天历史"""
         try:
-            db = self._get_db_session()
-            
             # 从数据库获取聊天历史
             messages = db.query(ChatMessage).filter(
                 ChatMessage.session_id == session_id
-            ).order_by(ChatMessage.created_at.asc()).all()
+            ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).all()
             
             history = []
             for msg in messages:
@@ -196,39 +241,44 @@ class ChatService:
         except Exception as e:
             logger.error(f"Failed to get chat history: {e}")
             return []
-        finally:
-            db.close()
     
-    def delete_chat_session(self, session_id: str, provider_id: str, 
+    def delete_chat_session(self, db: Session, session_id: str, provider_id: str, 
                           model_name: str) -> bool:
         """删除聊天会话"""
         try:
-            db = self._get_db_session()
-            
-            # 删除会话及其所有消息
-            session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-            if session:
-                db.delete(session)
-                db.commit()
+            # 直接以 DELETE ... WHERE 删除会话及其所有消息，无需先加载对象
+            db.execute(delete(ChatMessage).where(ChatMessage.session_id == session_id))
+            db.execute(delete(ChatSession).where(ChatSession.id == session_id))
+            db.commit()
             
             return True
             
         except Exception as e:
             logger.error(f"Failed to delete chat session: {e}")
             return False
-        finally:
-            db.close() 
 
-    def _get_task_transcript(self, task_id: str) -> Optional[List[TranscriptSegment]]:
-        """获取任务的转写数据"""
+    def _get_transcript_text(self, db: Session, task_id: str) -> Optional[str]:
+        """获取任务格式化后的转写文本，按转写写入时间缓存"""
         try:
-            # 从缓存文件读取转写数据
-            transcript_cache_file = Path(f"note_results/{task_id}_transcript.json")
-            if transcript_cache_file.exists():
-                data = json.loads(transcript_cache_file.read_text(encoding="utf-8"))
-                segments = [TranscriptSegment(**seg) for seg in data.get("segments", [])]
-                return segments
-            return None
+            version = get_task_transcript_version(db, task_id)
+            if version is None:
+                return None
+            # version 参与缓存键，转写更新后自动失效
+            cache_key = f"{task_id}:{version}"
+            transcript_text = self._TRANSCRIPT_CACHE.get(cache_key)
+            if transcript_text is None:
+                transcript_text = build_segment_text(self._get_task_transcript(db, task_id))
+                self._TRANSCRIPT_CACHE.set(cache_key, transcript_text)
+            return transcript_text or None
         except Exception as e:
+            # 读取失败时不写入缓存
             logger.error(f"Failed to get transcript for task {task_id}: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+    @staticmethod
+    def _get_task_transcript(db: Session, task_id: str) -> List[TranscriptSegment]:
+        """获取任务的转写数据"""
+        segments_json = get_task_transcript_json(db, task_id)
+        if segments_json is None:
+            raise LookupError(f"Transcript not found for task {task_id}")
+        return SEGMENTS_ADAPTER.validate_python(orjson.loads(segments_json))
@@ -15,6 +15,7 @@ from app.downloaders.bilibili_downloader import BilibiliDownloader
 from app.downloaders.douyin_downloader import DouyinDownloader
 from app.downloaders.local_downloader import LocalDownloader
 from app.downloaders.youtube_downloader import YoutubeDownloader
+from app.db.transcript_dao import upsert_task_transcript
 from app.db.video_task_dao import delete_task_by_video, insert_video_task
 from app.enmus.exception import NoteErrorEnum, ProviderErrorEnum
 from app.enmus.task_status_enums import TaskStatus
@@ -424,6 +425,8 @@ class NoteGenerator:
             try:
                 data = json.loads(transcript_cache_file.read_text(encoding="utf-8"))
                 segments = [TranscriptSegment(**seg) for seg in data.get("segments", [])]
+                # 旧缓存文件可能早于转写表，同步写入以供聊天读取
+                upsert_task_transcript(task_id, data.get("segments", []))
                 return TranscriptResult(language=data["language"], full_text=data["full_text"], segments=segments)
             except Exception as e:
                 logger.warning(f"加载转写缓存失败，将重新转写：{e}")
@@ -432,7 +435,9 @@ class NoteGenerator:
         try:
             logger.info("开始转写音频")
             transcript = self.transcriber.transcript(file_path=audio_file)
-            transcript_cache_file.write_text(json.dumps(asdict(transcript), ensure_ascii=False, indent=2), encoding="utf-8")
+            transcript_data = asdict(transcript)
+            transcript_cache_file.write_text(json.dumps(transcript_data, ensure_ascii=False, indent=2), encoding="utf-8")
+            upsert_task_transcript(task_id, transcript_data["segments"])
             logger.info(f"转写并缓存成功 ({transcript_cache_file})")
             return transcript
         except Exception as exc:
@@ -1,15 +1,13 @@
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from app.utils.status_code import StatusCode
 from pydantic import BaseModel
 from typing import Optional, Any
 
 
-from fastapi.responses import JSONResponse
-
 class ResponseWrapper:
     @staticmethod
     def success(data=None, msg="success", code=0):
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "code": code,
             "msg": msg,
             "data": data
@@ -17,7 +15,7 @@ class ResponseWrapper:
 
     @staticmethod
     def error(msg="error", code=500, data=None):
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "code": code,
             "msg": str(msg),
             "data": data